@@ -1,11 +1,28 @@
 """sqlalchemy_nested_sets"""
-from collections import deque
-
-from sqlalchemy import Integer, and_, case, desc, event, func, select, Table
+from bisect import bisect_right, insort
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from itertools import chain
+from math import inf
+
+from sqlalchemy import (
+    Integer,
+    and_,
+    bindparam,
+    case,
+    event,
+    func,
+    Index,
+    inspect,
+    or_,
+    select,
+    Table,
+    update,
+)
 from sqlalchemy.ext.hybrid import hybrid_method
 from sqlalchemy.orm import (
     aliased,
-    declarative_mixin,
     declared_attr,
     foreign,
     object_session,
@@ -13,7 +30,12 @@ from sqlalchemy.orm import (
     remote,
     Mapped,
     mapped_column,
+    object_mapper,
 )
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
+
+_PENDING = "nested_pending"
+_FLUSHED = "nested_flushed"
 
 
 class NestedSetException(Exception):
@@ -28,7 +50,20 @@ class NestedSetMovementNotAllowed(NestedSetException):
     pass
 
 
-@declarative_mixin
+def nested_set_indexes(tablename):
+    """Indexes NestedSet declares on lft and rgt of table.
+
+    (lft, rgt) serves descendant and ancestor lookups, rgt alone serves
+    the max(rgt) lookup and renumbering of nodes right of a position.
+
+    :param tablename:
+    """
+    return (
+        Index(f"ix_{tablename}_lft_rgt", "lft", "rgt"),
+        Index(f"ix_{tablename}_rgt", "rgt"),
+    )
+
+
 class NestedSet:
     """NestedSet is a mixin class used for nested set presentation."""
 
@@ -38,6 +73,17 @@ class NestedSet:
     right: Mapped[int] = mapped_column("rgt", Integer, nullable=False)
     _children = None
 
+    @declared_attr.directive
+    def __table_args__(cls):
+        """Indexes used by range queries on lft and rgt.
+
+        A model defining its own ``__table_args__`` replaces this one and
+        should add ``*nested_set_indexes(__tablename__)`` to it.
+
+        :param cls:
+        """
+        return nested_set_indexes(cls.__tablename__)
+
     @declared_attr
     def descendants(cls):
         """All descendants of node ordered from left to right.
@@ -72,15 +118,57 @@ class NestedSet:
 
     @property
     def children(self):
-        """Node children. Avaialbe after generate tree is called."""
-        if self._children:
-            return tuple(self._children)
-        return None
+        """Node children. Avaialbe after generate tree is called.
+
+        Reset when the tree is changed.
+        """
+        return self._children or None
+
+    def __init_subclass__(cls, **kwargs):
+        """Cache primary key name so it isn't looked up on every access."""
+        super().__init_subclass__(**kwargs)
+        cls._pk_name = cls.get_primary_key_name()
+
+    @classmethod
+    @contextmanager
+    def bulk_mode(cls, session):
+        """Number nodes added to session all at once when they are flushed.
+
+        Space for the new nodes is opened with a single UPDATE instead of
+        one UPDATE per inserted node. Pending nodes are flushed on exit.
+
+        :param session:
+        """
+
+        def number_pending(session, flush_context, instances):
+            cls.flush_pending(session)
+
+        session.info.setdefault(_PENDING, set())
+        event.listen(session, "before_flush", number_pending)
+        try:
+            yield session
+            session.flush()
+        finally:
+            event.remove(session, "before_flush", number_pending)
+            session.info.pop(_PENDING, None)
 
     @classmethod
-    def __declare_first__(cls):
-        """__declare_first__."""
-        cls.__mapper__.batch = False
+    def flush_pending(cls, session):
+        """Assign lft/rgt to all new nodes in session and open space for them.
+
+        Numbered nodes are skipped by before_insert when they are flushed.
+
+        :param session:
+        """
+        registry = session.info.setdefault(_PENDING, set())
+        trees = defaultdict(list)
+        for node in session.new:
+            if isinstance(node, cls) and inspect(node) not in registry:
+                trees[object_mapper(node).base_mapper].append(node)
+
+        for mapper, nodes in trees.items():
+            _number_pending(session, mapper, nodes)
+            registry.update(inspect(node) for node in nodes)
 
     @classmethod
     def get_primary_key_name(cls):
@@ -90,12 +178,12 @@ class NestedSet:
     @classmethod
     def get_primary_key_column(cls):
         """get_primary_key_column."""
-        return getattr(cls, cls.get_primary_key_name())
+        return getattr(cls, cls._pk_name)
 
     @property
     def primary_key(self):
         """primary_key."""
-        return getattr(self, self.get_primary_key_name())
+        return getattr(self, self._pk_name)
 
     @primary_key.setter
     def primary_key(self, val):
@@ -103,7 +191,7 @@ class NestedSet:
 
         :param val:
         """
-        setattr(self, self.get_primary_key_name(), val)
+        setattr(self, self._pk_name, val)
 
     def __repr__(self):
         """__repr__."""
@@ -116,23 +204,36 @@ class NestedSet:
     def get_ancestors(self):
         """get_ancestors."""
         session = object_session(self)
-        ealias = aliased(self.__class__)
+        # Bounds are read after pending nodes are inserted and numbered
+        session.flush()
         return (
             session.query(self.__class__)
-            .filter(ealias.left.between(self.__class__.left, self.__class__.right))
-            .filter(getattr(ealias, self.get_primary_key_name()) == self.primary_key)
+            .filter(self.__class__.left <= self.left)
+            .filter(self.__class__.right >= self.right)
+            .order_by(self.__class__.left)
             .all()
         )
 
     def decendents_query(self):
         """decendents_query."""
+        return self.descendants_query(inclusive=True)
+
+    def descendants_query(self, inclusive: bool = False):
+        """Query of descendants ordered by lft, served by a range scan on lft.
+
+        :param inclusive: wheter should include itself
+        :type inclusive: bool
+        """
+        cls = self.__class__
         session = object_session(self)
+        # Bounds are read after pending nodes are inserted and numbered
+        session.flush()
+        if inclusive:
+            criterion = cls.left.between(self.left, self.right)
+        else:
+            criterion = and_(cls.left > self.left, cls.left < self.right)
 
-        return (
-            session.query(self.__class__)
-            .filter(self.__class__.left.between(self.left, self.right))
-            .order_by(self.__class__.left)
-        )
+        return session.query(cls).filter(criterion).order_by(cls.left)
 
     @hybrid_method
     def is_ancestor_of(self, other, inclusive: bool = False):
@@ -142,9 +243,13 @@ class NestedSet:
         :param inclusive: wheter should include itself
         :type inclusive: bool
         """
+        if isinstance(self, NestedSet) and isinstance(other, NestedSet):
+            if inclusive:
+                return self.left <= other.left and other.right <= self.right
+            return self.left < other.left and other.right < self.right
         if inclusive:
-            return (self.left <= other.left) & (other.right <= self.right)
-        return (self.left < other.left) & (other.right < self.right)
+            return and_(self.left <= other.left, other.right <= self.right)
+        return and_(self.left < other.left, other.right < self.right)
 
     @hybrid_method
     def is_descendant_of(self, other, inclusive: bool = False):
@@ -156,108 +261,52 @@ class NestedSet:
         """
         return other.is_ancestor_of(self, inclusive)
 
-    def generate_tree(self):
-        """Generates tree out from node. All descendats get children property availalbe."""
-        tree = self
-        tree._children = deque()
-        stack = [tree]
-        for node in self.descendants:
-            parent = stack.pop()
-            while node.left > parent.right:
-                parent = stack.pop()
-
-            node._children = deque()
-            parent._children.append(node)
-            stack.append(parent)
-            stack.append(node)
-
-    def _move_outside(self):
-        """_move_outside."""
-        table = self.__table__
-        session = object_session(self)
-        session.execute(
-            table.update()
-            .where(
-                and_(
-                    table.c.lft >= self.left,
-                    table.c.rgt <= self.right,
-                )
-            )
-            .values(lft=-table.c.lft, rgt=-table.c.rgt)
-        )
+    def generate_tree(self, *, options=None):
+        """Generates tree out from node. All descendats get children property availalbe.
+
+        Descendants are loaded with a single query. Relationships used while
+        walking the tree can be loaded along with them by passing loader
+        options, e.g. ``options=[selectinload(Model.some_relationship)]``.
 
-    def _shrink_space(self):
-        """_shrink_space."""
-        table = self.__table__
+        :param options: loader options applied to the descendants query
+        """
+        cls = self.__class__
         session = object_session(self)
-        width = self.right - self.left + 1
-        session.execute(
-            table.update()
-            .where(and_(table.c.rgt > self.right))
-            .values(
-                lft=case(
-                    (
-                        table.c.lft > self.right,
-                        table.c.lft - width,
-                    ),
-                    else_=table.c.lft,
-                ),
-                rgt=table.c.rgt - width,
-            )
-        )
+        if session is None:
+            nodes = list(self.descendants)
+        else:
+            # Bounds are read after pending nodes are inserted and numbered
+            session.flush()
+            nodes = session.scalars(
+                select(cls)
+                .where(and_(cls.left > self.left, cls.left < self.right))
+                .order_by(cls.left)
+                .options(*(options or ()))
+            ).all()
+
+        for node, children in zip(chain((self,), nodes), _group_children(self, nodes)):
+            node._children = children
 
     def move_before(self, target):
         """move_before.
 
         :param target:
         """
-        if self.left <= target.left and self.right >= target.right:
-            raise NestedSetMovementNotAllowed("Can't move before child node")
-
-        session = object_session(self)
-        # Move itself and children outside of tree
-        self._move_outside()
-        # Shrink unused space
-        self._shrink_space()
-        # Move other nodes to the right
-        move_node_before(self.__table__, session, self, target)
+        _relocate(object_session(self), self, target, "before")
 
     def move_after(self, target):
         """move_after.
 
         :param target:
         """
-        if self.left <= target.left and self.right >= target.right:
-            raise NestedSetMovementNotAllowed("Can't move after child node")
-        # self.emp = self.emp
-        session = object_session(self)
-        # Move itself and children outside of tree
-        self._move_outside()
-        # Shrink unused space
-        self._shrink_space()
-        move_node_after(self.__table__, session, self, target)
+        _relocate(object_session(self), self, target, "after")
 
     def move_inside(self, target):
         """move_inside.
 
         :param target:
         """
-        if self.left <= target.left and self.right >= target.right:
-            raise NestedSetMovementNotAllowed("Can't move inside child node")
-        session = object_session(self)
-        self._move_outside()
-        self._shrink_space()
-        move_node_inside(self.__table__, session, self, target)
-
-
-def _primary_key_match(table, instance):
-    """primary_key_match.
-
-    :param table:
-    :param instance:
-    """
-    column = instance.get_primary_key_column()
-    return getattr(table.c, column.name) == instance.primary_key
+        _relocate(object_session(self), self, target, "inside")
 
 
 @event.listens_for(NestedSet, "before_insert", propagate=True)
@@ -269,26 +318,156 @@ def before_insert(mapper, connection, instance):
     :param instance:
     """
 
+    pending = object_session(instance).info.get(_PENDING)
+    if pending and inspect(instance) in pending:
+        pending.discard(inspect(instance))
+        return
+
     nested_sets = mapper.persist_selectable
+    flushed = _flush_state(object_session(instance), mapper)
 
     if not instance.parent:
-        right_most = connection.scalar(
-            select(nested_sets.c.rgt).order_by(desc(nested_sets.c.rgt))
-        )
-        if not right_most:
-            right_most = 0
-        instance.left = right_most + 1
-        instance.right = right_most + 2
-    else:
-        right_most_sibling = connection.scalar(
-            select(nested_sets.c.rgt).where(
-                _primary_key_match(nested_sets, instance.parent)
+        if flushed["right_most"] is None:
+            # Nodes of the same flush are numbered before any of them is inserted
+            flushed["right_most"] = max(
+                connection.scalar(
+                    select(func.coalesce(func.max(nested_sets.c.rgt), 0))
+                ),
+                max((node.right for node in flushed["current"].values()), default=0),
             )
-        )
+        instance.left = flushed["right_most"] + 1
+        instance.right = flushed["right_most"] + 2
+        flushed["right_most"] += 2
+    else:
+        right_most_sibling = _current_right(flushed, instance.parent)
 
         increase_space(nested_sets, connection, right_most_sibling, 2)
+        _space_opened(flushed, right_most_sibling)
         instance.left = right_most_sibling
         instance.right = right_most_sibling + 1
+    flushed["current"][id(instance)] = instance
+
+
+def _flush_state(session, mapper):
+    """Space opened by before_insert in the current flush of session.
+
+    Nodes in ``current`` hold up to date lft/rgt and are renumbered right
+    away, ``right_most`` is the running maximum rgt once a root was added.
+    Nodes in ``loaded`` had lft/rgt loaded when the state was created and
+    keep those values until _sync_loaded shifts them by two for every
+    threshold at or below them, so a flush scans the session once instead
+    of once per inserted node. Nodes loaded later read rows that already
+    include the opened space and are left alone.
+
+    :param session:
+    :param mapper:
+    """
+    _listen(session)
+    states = session.info.setdefault(_FLUSHED, {})
+    base_mapper = mapper.base_mapper
+    if base_mapper not in states:
+        cls = base_mapper.class_
+        # Numbered new nodes are inserted after every before_insert call
+        current = {
+            id(node): node
+            for node in session.new
+            if isinstance(node, cls) and node.__dict__.get("right") is not None
+        }
+        loaded = {
+            id(node): node
+            for node in session.identity_map.values()
+            if isinstance(node, cls)
+            and "left" in node.__dict__
+            and "right" in node.__dict__
+        }
+        states[base_mapper] = {
+            "current": current,
+            "loaded": loaded,
+            "thresholds": [],
+            "right_most": None,
+        }
+    return states[base_mapper]
+
+
+def _current_right(flushed, node):
+    """rgt of node after space opened so far in the flush.
+
+    :param flushed: state returned by _flush_state
+    :param node:
+    """
+    current = flushed["current"]
+    if id(node) not in current:
+        if id(node) in flushed["loaded"]:
+            values = node.__dict__
+            unmodified = not instance_state(node).modified
+            for key in ("left", "right"):
+                shifted = _shifted(flushed["thresholds"], values[key])
+                _set_remapped(node, values, key, shifted, unmodified)
+        # Values loaded during the flush come from rows already renumbered
+        current[id(node)] = node
+    return node.right
+
+
+def _space_opened(flushed, position):
+    """Record two positions opened at position during the flush.
+
+    :param flushed: state returned by _flush_state
+    :param position:
+    """
+    for node in flushed["current"].values():
+        values = node.__dict__
+        if values["right"] < position:
+            continue
+        values.pop("_children", None)
+        unmodified = not instance_state(node).modified
+        for key in ("left", "right"):
+            if values[key] >= position:
+                _set_remapped(node, values, key, values[key] + 2, unmodified)
+
+    if flushed["right_most"] is not None:
+        flushed["right_most"] += 2
+
+    thresholds = flushed["thresholds"]
+    # Lowest value from before the flush that the UPDATE moved
+    low, high = position - 2 * len(thresholds), position
+    while low < high:
+        middle = (low + high) // 2
+        if _shifted(thresholds, middle) >= position:
+            high = middle
+        else:
+            low = middle + 1
+    insort(thresholds, low)
+
+
+def _shifted(thresholds, value):
+    """Value from before the flush moved by the space opened in it.
+
+    :param thresholds: lowest moved value of every opened space, sorted
+    :param value:
+    """
+    return value + 2 * bisect_right(thresholds, value)
+
+
+def _sync_loaded(session):
+    """Apply space opened by the current flush to the other loaded nodes.
+
+    :param session:
+    """
+    for mapper, flushed in session.info.pop(_FLUSHED, {}).items():
+        thresholds = flushed["thresholds"]
+        if thresholds:
+            current = flushed["current"]
+            _remap_loaded(
+                session,
+                mapper,
+                partial(_shifted, thresholds),
+                thresholds[0],
+                nodes=[
+                    node
+                    for key, node in flushed["loaded"].items()
+                    if key not in current
+                ],
+            )
 
 
 @event.listens_for(NestedSet, "after_delete", propagate=True)
@@ -300,12 +479,63 @@ def after_delete(mapper, connection, instance):
     :param instance:
     """
     nested_sets = mapper.persist_selectable
-    instance._shrink_space()
+    _sync_loaded(object_session(instance))
+    left, right = instance.left, instance.right
+    # Descendants go first, closing the gap moves other nodes into the range
     connection.execute(
         nested_sets.delete().where(
-            and_(nested_sets.c.lft > instance.left, nested_sets.c.rgt < instance.right)
+            and_(nested_sets.c.lft > left, nested_sets.c.rgt < right)
         )
     )
+    width = right - left + 1
+    _shrink_space(nested_sets, connection, right, width)
+    _remap_loaded(
+        object_session(instance),
+        mapper,
+        lambda value: value - width,
+        right + 1,
+    )
+
+
+def _listen(session):
+    """Listen to flush and rollback of session once it holds renumbered nodes.
+
+    Listeners are added to the session itself instead of the Session class,
+    sessions never touching a nested set don't run them.
+
+    :param session:
+    """
+    if not event.contains(session, "after_flush", after_flush):
+        event.listen(session, "after_flush", after_flush)
+        event.listen(session, "after_soft_rollback", after_soft_rollback)
+
+
+def after_flush(session, flush_context):
+    """after_flush.
+
+    :param session:
+    :param flush_context:
+    """
+    _sync_loaded(session)
+
+
+def after_soft_rollback(session, previous_transaction):
+    """Forget space opened by a flush that failed.
+
+    Rolling back a savepoint only expires modified nodes, while loaded
+    nodes are renumbered as if the new lft/rgt were committed, so their
+    lft/rgt are expired as well.
+
+    :param session:
+    :param previous_transaction:
+    """
+    session.info.pop(_FLUSHED, None)
+    if not previous_transaction.nested:
+        return
+    for node in session.identity_map.values():
+        if isinstance(node, NestedSet):
+            node.__dict__.pop("_children", None)
+            session.expire(node, ["left", "right"])
 
 
 def increase_space(nested_sets: Table, connection, position, space, inclusive=True):
@@ -318,10 +548,29 @@ def increase_space(nested_sets: Table, connection, position, space, inclusive=Tr
     :param inclusive:
     """
 
+    connection.execute(
+        _increase_space_statement(nested_sets, inclusive),
+        {"position": position, "space": space},
+    )
+
+
+@lru_cache(maxsize=None)
+def _increase_space_statement(nested_sets, inclusive):
+    """UPDATE statement used by increase_space, built once per table.
+
+    Only rows whose rgt moves are matched, lft of ancestors spanning the
+    position is kept by the CASE. One statement per call keeps the per row
+    insert path at a single round trip.
+
+    :param nested_sets:
+    :param inclusive:
+    """
+    position = bindparam("position")
+    space = bindparam("space")
     comparason = (
         nested_sets.c.rgt >= position if inclusive else nested_sets.c.rgt > position
     )
-    connection.execute(
+    return (
         nested_sets.update()
         .where(comparason)
         .values(
@@ -334,71 +583,335 @@ def increase_space(nested_sets: Table, connection, position, space, inclusive=Tr
     )
 
 
-def return_inside(nested_sets, connection, distance):
-    """return_inside.
+def _shrink_space(nested_sets, connection, right, width):
+    """Close the gap of given width left of right.
 
     :param nested_sets:
     :param connection:
-    :param distance:
+    :param right:
+    :param width:
     """
     connection.execute(
-        nested_sets.update()
-        .where(and_(nested_sets.c.lft < 0))
-        .values(lft=-nested_sets.c.lft - distance, rgt=-nested_sets.c.rgt - distance)
+        _shrink_space_statement(nested_sets), {"right": right, "width": width}
     )
 
 
-def move_node_before(nested_sets, connection, instance, target):
-    """move_node_before.
+@lru_cache(maxsize=None)
+def _shrink_space_statement(table):
+    """UPDATE statement closing the gap left of ``right``, built once per table.
 
-    :param nested_sets:
-    :param connection:
-    :param instance:
-    :param target:
+    Only rows whose rgt moves are matched, lft of ancestors of the gap is
+    kept by the CASE.
+
+    :param table:
     """
-    width = instance.right - instance.left + 1
-    target_left = connection.scalar(
-        select(nested_sets.c.lft).where(_primary_key_match(nested_sets, target))
+    right = bindparam("right")
+    width = bindparam("width")
+    return (
+        table.update()
+        .where(table.c.rgt > right)
+        .values(
+            lft=case(
+                (table.c.lft > right, table.c.lft - width),
+                else_=table.c.lft,
+            ),
+            rgt=table.c.rgt - width,
+        )
     )
-    increase_space(nested_sets, connection, target_left, width)
-    distance = instance.left - target_left
 
-    return_inside(nested_sets, connection, distance)
 
+def _group_children(root, nodes):
+    """Children of root and of each of its descendants, in that order.
 
-def move_node_after(nested_sets, connection, instance, target):
-    """move_node_after.
+    Parent of every node is found in one sweep keeping parallel stacks of
+    open node indexes and their rgt, so only nodes with children get a list.
 
-    :param nested_sets:
-    :param connection:
+    :param root:
+    :param nodes: descendants of root ordered by lft
+    """
+    parents = []
+    open_indexes = [-1]
+    open_rights = [root.right]
+    for index, node in enumerate(nodes):
+        while node.left > open_rights[-1]:
+            open_indexes.pop()
+            open_rights.pop()
+        parents.append(open_indexes[-1])
+        open_indexes.append(index)
+        open_rights.append(node.right)
+
+    children = {}
+    for node, parent in zip(nodes, parents):
+        if parent in children:
+            children[parent].append(node)
+        else:
+            children[parent] = [node]
+    return [tuple(children.get(index, ())) for index in range(-1, len(nodes))]
+
+
+def _relocate(session, instance, target, mode):
+    """Move instance with its descendants next to or inside target.
+
+    The moved subtree and every node between its old and new place are
+    renumbered by a single UPDATE, so each row is written at most once.
+    Being one statement, the move can't leave the tree half renumbered
+    and needs no savepoint of its own.
+
+    :param session:
     :param instance:
     :param target:
+    :param mode: ``"before"``, ``"after"`` or ``"inside"`` target
     """
-    width = instance.right - instance.left + 1
-    target_right = connection.scalar(
-        select(nested_sets.c.rgt).where(_primary_key_match(nested_sets, target))
+    # Positions are read after pending nodes are inserted and numbered
+    session.flush()
+    if instance.left <= target.left and instance.right >= target.right:
+        raise NestedSetMovementNotAllowed(f"Can't move {mode} child node")
+
+    if mode == "before":
+        position = target.left
+    elif mode == "after":
+        position = target.right + 1
+    else:
+        position = target.right
+
+    left, right = instance.left, instance.right
+    if position in (left, right + 1):
+        # Already in place
+        return
+
+    width = right - left + 1
+    if position > right:
+        low, high = right + 1, position - 1
+        offset, shift = position - right - 1, -width
+    else:
+        low, high = position, left - 1
+        offset, shift = position - left, width
+
+    def remap(value):
+        if left <= value <= right:
+            return value + offset
+        if low <= value <= high:
+            return value + shift
+        return value
+
+    mapper = object_mapper(instance)
+    session.execute(
+        _relocate_statement(mapper.base_mapper.class_),
+        {
+            "start": min(left, low),
+            "end": max(right, high),
+            "first": left,
+            "last": right,
+            "offset": offset,
+            "low": low,
+            "high": high,
+            "shift": shift,
+        },
     )
-    increase_space(nested_sets, connection, target_right, width, inclusive=False)
-    distance = instance.left - target_right - 1
-    return_inside(nested_sets, connection, distance)
+    _remap_loaded(session, mapper, remap, min(left, low), max(right, high))
 
 
-def move_node_inside(nested_sets, connection, instance, target):
-    """move_node_inside.
+@lru_cache(maxsize=None)
+def _relocate_statement(cls):
+    """UPDATE statement used by _relocate, built once per model.
 
-    :param nested_sets:
-    :param connection:
-    :param instance:
-    :param target:
+    Only rows with lft or rgt between the old and new place are touched.
+    Loaded nodes are renumbered by _relocate itself, so the session
+    doesn't need to synchronize them.
+
+    :param cls:
+    """
+
+    def relocated(column):
+        return case(
+            (
+                column.between(bindparam("first"), bindparam("last")),
+                column + bindparam("offset"),
+            ),
+            (
+                column.between(bindparam("low"), bindparam("high")),
+                column + bindparam("shift"),
+            ),
+            else_=column,
+        )
+
+    start, end = bindparam("start"), bindparam("end")
+    return (
+        update(cls)
+        .where(or_(cls.left.between(start, end), cls.right.between(start, end)))
+        .values({cls.left: relocated(cls.left), cls.right: relocated(cls.right)})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _number_pending(session, mapper, nodes):
+    """Number new nodes of one tree and open space for them with one UPDATE.
+
+    New subtrees are appended as last children of their existing parents,
+    or after the right most tree when they have no parent.
+
+    :param session:
+    :param mapper:
+    :param nodes: new nodes in insertion order
     """
-    width = instance.right - instance.left + 1
-    target_right = connection.scalar(
-        select(nested_sets.c.rgt).where(_primary_key_match(nested_sets, target))
+    cls = mapper.class_
+    new = {id(node) for node in nodes}
+    children = defaultdict(list)
+    parents = {}
+    tops = defaultdict(list)
+    for node in nodes:
+        parent = node.parent
+        if parent is not None and id(parent) in new:
+            children[id(parent)].append(node)
+        else:
+            key = None if parent is None else id(parent)
+            parents[key] = parent
+            tops[key].append(node)
+
+    widths = {
+        key: sum(2 * _subtree_size(node, children) for node in subtrees)
+        for key, subtrees in tops.items()
+    }
+    existing = sorted(
+        (parent for parent in parents.values() if parent is not None),
+        key=lambda parent: parent.right,
     )
-    increase_space(nested_sets, connection, target_right, width)
-    distance = instance.left - target_right
+    gaps = []
+    opened = 0
+    for parent in existing:
+        opened += widths[id(parent)]
+        gaps.append((parent.right, opened))
+
+    if gaps:
+
+        def opened_before(column):
+            return case(
+                *((column >= right, column + width) for right, width in reversed(gaps)),
+                else_=column,
+            )
 
-    return_inside(nested_sets, connection, distance)
+        def remap(value):
+            for right, width in reversed(gaps):
+                if value >= right:
+                    return value + width
+            return value
+
+        session.execute(
+            update(cls)
+            .where(cls.right >= gaps[0][0])
+            .values(
+                {cls.left: opened_before(cls.left), cls.right: opened_before(cls.right)}
+            )
+            .execution_options(synchronize_session=False)
+        )
+        _remap_loaded(session, mapper, remap, gaps[0][0])
+
+    for parent in existing:
+        start = parent.right - widths[id(parent)]
+        for node in tops[id(parent)]:
+            start = _number_subtree(node, children, start)
+
+    if None in parents:
+        right_most = session.scalar(select(func.coalesce(func.max(cls.right), 0)))
+        start = right_most + 1
+        for node in tops[None]:
+            start = _number_subtree(node, children, start)
+
+
+def _subtree_size(root, children):
+    """Count new nodes in subtree of root.
+
+    :param root:
+    :param children: new children keyed by id of their parent
+    """
+    size = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        size += 1
+        stack.extend(children[id(node)])
+    return size
+
+
+def _number_subtree(root, children, position):
+    """Number new subtree of root starting at position.
+
+    Returns first position after the subtree.
+
+    :param root:
+    :param children: new children keyed by id of their parent
+    :param position:
+    """
+    root.left = position
+    position += 1
+    stack = [(root, iter(children[id(root)]))]
+    while stack:
+        node, remaining = stack[-1]
+        child = next(remaining, None)
+        if child is None:
+            node.right = position
+            stack.pop()
+        else:
+            child.left = position
+            stack.append((child, iter(children[id(child)])))
+        position += 1
+    return position
+
+
+def _remap_loaded(session, mapper, remap, low, high=None, nodes=None):
+    """Renumber loaded nodes the same way the database rows were renumbered.
+
+    Keeps lft/rgt of nodes held by the session in sync with the UPDATE
+    statements issued by this module, so they don't have to be reloaded.
+    Only values between low and high are passed to remap and only changed
+    ones are written. Children collected by generate_tree are dropped from
+    renumbered nodes and from ancestors spanning the range as they may be
+    stale.
+
+    :param session:
+    :param mapper:
+    :param remap: maps old lft/rgt value to the new one
+    :param low: lowest value remap may change
+    :param high: highest value remap may change, unbounded when None
+    :param nodes: nodes to renumber, all loaded ones when None
+    """
+    _listen(session)
+    cls = mapper.base_mapper.class_
+    if high is None:
+        high = inf
+    if nodes is None:
+        nodes = chain(session.identity_map.values(), session.new)
+    for node in nodes:
+        if not isinstance(node, cls):
+            continue
+        values = node.__dict__
+        left, right = values.get("left"), values.get("right")
+        if right is not None and right < low or left is not None and left > high:
+            continue
+        values.pop("_children", None)
+        # Without pending changes the loaded value is the committed one
+        unmodified = not instance_state(node).modified
+        if left is not None and left >= low:
+            _set_remapped(node, values, "left", remap(left), unmodified)
+        if right is not None and right <= high:
+            _set_remapped(node, values, "right", remap(right), unmodified)
+
+
+def _set_remapped(node, values, key, value, unmodified):
+    """Write remapped lft/rgt value of loaded node as committed.
+
+    :param node:
+    :param values: ``__dict__`` of node
+    :param key: ``"left"`` or ``"right"``
+    :param value:
+    :param unmodified: node has no pending changes
+    """
+    if values[key] == value:
+        return
+    if unmodified:
+        values[key] = value
+    else:
+        set_committed_value(node, key, value)
 
 
 def print_tree(session, model):
@@ -408,12 +921,13 @@ def print_tree(session, model):
     :param model:
     """
     ealias = aliased(model)
-    for indentation, employee in (
-        session.query(
-            func.count(model.get_primary_key_column()).label("indentation") - 1, ealias
-        )
-        .filter(ealias.left.between(model.left, model.right))
-        .group_by(getattr(ealias, model.get_primary_key_name()))
-        .order_by(ealias.left)
+    depth = (
+        select(func.count())
+        .where(and_(ealias.left < model.left, ealias.right > model.right))
+        .correlate(model)
+        .scalar_subquery()
+    )
+    for indentation, employee in session.execute(
+        select(depth, model).order_by(model.left)
     ):
         yield "    " * indentation + repr(employee)
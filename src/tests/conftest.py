@@ -1,19 +1,73 @@
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import raiseload, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from tests.node import Base
 
+Session = sessionmaker(join_transaction_mode="create_savepoint")
 
-@pytest.fixture
+
+@pytest.fixture(scope="session")
 def engine():
 
-    _engine = create_engine("sqlite:///:memory:", echo=False)
+    _engine = create_engine(
+        "sqlite:///file::memory:?cache=shared&uri=true",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+        echo=False,
+    )
+
+    @event.listens_for(_engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself so SAVEPOINTs work with pysqlite
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA journal_mode=MEMORY")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(_engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
     Base.metadata.create_all(_engine)
     return _engine
 
 
+def raise_on_lazy_load(orm_execute_state):
+    # Relationships of every loaded node raise instead of lazy loading
+    if (
+        orm_execute_state.is_select
+        and not orm_execute_state.is_column_load
+        and not orm_execute_state.is_relationship_load
+    ):
+        orm_execute_state.statement = orm_execute_state.statement.options(
+            raiseload("*")
+        )
+
+
 @pytest.fixture
 def session(engine):
-    with Session(engine) as session:
-        yield session
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        with Session(bind=connection) as session:
+            event.listen(session, "do_orm_execute", raise_on_lazy_load)
+            yield session
+        transaction.rollback()
+
+
+@pytest.fixture
+def statements(engine):
+    executed = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", collect)
+    yield executed
+    event.remove(engine, "before_cursor_execute", collect)
@@ -1,7 +1,9 @@
+import sys
 from collections import namedtuple
+from itertools import zip_longest
 
-from sqlalchemy import String
-from sqlalchemy.orm import Mapped, mapped_column, declarative_base
+from sqlalchemy import String, select
+from sqlalchemy.orm import Mapped, mapped_column, declarative_base, object_session
 
 from nested_sets import NestedSet
 
@@ -24,14 +26,45 @@ NodeTuple = namedtuple("Node", ["title", "children"], defaults=(None, None))
 
 
 def generate_node(model: Node):
-    return NodeTuple(
-        title=model.title,
-        children=tuple(generate_node(child) for child in model.children)
-        if model.children
-        else None,
-    )
+    ordered = [model]
+    for node in ordered:
+        ordered.extend(node.children or ())
+
+    built = {}
+    for node in reversed(ordered):
+        children = node.children
+        built[node] = NodeTuple(
+            title=sys.intern(node.title),
+            children=(
+                tuple(built.pop(child) for child in children) if children else None
+            ),
+        )
+    return built[model]
 
 
 def model_to_tree(model):
     model.generate_tree()
     return generate_node(model)
+
+
+def preorder(tree):
+    stack = [(tree, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node.title, depth
+        stack.extend((child, depth + 1) for child in reversed(node.children or ()))
+
+
+def assert_tree(model, expected):
+    rows = object_session(model).execute(
+        select(Node.title, Node.left, Node.right)
+        .where(Node.left.between(model.left, model.right))
+        .order_by(Node.left)
+    )
+    rights = []
+    for row, node in zip_longest(rows, preorder(expected)):
+        assert row is not None and node is not None
+        while rights and row.left > rights[-1]:
+            rights.pop()
+        assert (row.title, len(rights)) == node
+        rights.append(row.right)
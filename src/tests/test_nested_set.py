@@ -1,27 +1,51 @@
 import pytest
-from tests.node import Node, model_to_tree, NodeTuple
+from sqlalchemy import Integer, UniqueConstraint, event, insert, text
+from sqlalchemy.orm import Mapped, declarative_base, mapped_column
+from nested_sets import NestedSet, after_flush, nested_set_indexes, print_tree
+from tests.node import Node, assert_tree, model_to_tree, NodeTuple
 
 
 def select_by_title(session, title):
-    return session.query(Node).where(Node.title == title).one()
+    return session.get(Node, title)
 
 
-@pytest.fixture
-def output_tree():
-    return NodeTuple(
-        title="Albert",
-        children=(
-            NodeTuple(title="Bert"),
-            NodeTuple(
-                title="Chuck",
-                children=(NodeTuple(title="Donna"), NodeTuple(title="Eddie"), NodeTuple(title="Fred")),
-            ),
+def statement_kinds(statements):
+    kinds = (statement.split()[0] for statement in statements)
+    return [kind for kind in kinds if kind not in ("SAVEPOINT", "RELEASE")]
+
+
+OUTPUT_TREE = NodeTuple(
+    title="Albert",
+    children=(
+        NodeTuple(title="Bert"),
+        NodeTuple(
+            title="Chuck",
+            children=(NodeTuple(title="Donna"), NodeTuple(title="Eddie"), NodeTuple(title="Fred")),
         ),
-    )
+    ),
+)
 
 
 @pytest.fixture
 def base_tree(session):
+    session.execute(
+        insert(Node),
+        [
+            {"title": "Albert", "left": 1, "right": 12},
+            {"title": "Bert", "left": 2, "right": 3},
+            {"title": "Chuck", "left": 4, "right": 11},
+            {"title": "Donna", "left": 5, "right": 6},
+            {"title": "Eddie", "left": 7, "right": 8},
+            {"title": "Fred", "left": 9, "right": 10},
+        ],
+    )
+    session.commit()
+
+    return select_by_title(session, "Albert")
+
+
+@pytest.fixture
+def inserted_tree(session):
     albert = Node(title="Albert")
     bert = Node(title="Bert", parent=albert)
     chuck = Node(title="Chuck", parent=albert)
@@ -35,8 +59,104 @@ def base_tree(session):
     return albert
 
 
-def test_single_tree(session, base_tree, output_tree):
-    assert model_to_tree(base_tree) == output_tree
+def test_single_tree(session, inserted_tree):
+    assert_tree(inserted_tree, OUTPUT_TREE)
+
+
+def test_model_to_tree_single_query(session, base_tree, statements):
+    statements.clear()
+    assert model_to_tree(base_tree) == OUTPUT_TREE
+    assert len(statements) == 1
+
+
+def test_model_to_tree_with_pending_nodes(session, base_tree):
+    bert = select_by_title(session, "Bert")
+    chuck = select_by_title(session, "Chuck")
+    session.add_all([Node(title="George", parent=bert), Node(title="Harry", parent=bert)])
+    assert model_to_tree(chuck) == OUTPUT_TREE.children[1]
+
+
+def test_print_tree(session, base_tree):
+    lines = list(print_tree(session, Node))
+    assert [len(line) - len(line.lstrip()) for line in lines] == [0, 4, 4, 8, 8, 8]
+    assert "title=Eddie" in lines[4]
+
+
+def test_get_ancestors(session, base_tree):
+    eddie = select_by_title(session, "Eddie")
+    assert [node.title for node in eddie.get_ancestors()] == ["Albert", "Chuck", "Eddie"]
+
+
+def test_get_ancestors_with_pending_nodes(session, base_tree):
+    bert = select_by_title(session, "Bert")
+    donna = select_by_title(session, "Donna")
+    george = Node(title="George", parent=donna)
+    session.add_all([Node(title="Harry", parent=bert), george])
+    assert [node.title for node in donna.get_ancestors()] == ["Albert", "Chuck", "Donna"]
+    assert [node.title for node in george.get_ancestors()] == [
+        "Albert",
+        "Chuck",
+        "Donna",
+        "George",
+    ]
+
+
+def test_descendants_query(session, base_tree):
+    chuck = select_by_title(session, "Chuck")
+    descendants = chuck.descendants_query()
+    assert [node.title for node in descendants] == ["Donna", "Eddie", "Fred"]
+    assert descendants.filter(Node.title == "Eddie").count() == 1
+    assert descendants.filter(Node.title == "Bert").count() == 0
+    inclusive = chuck.descendants_query(inclusive=True)
+    assert [node.title for node in inclusive] == ["Chuck", "Donna", "Eddie", "Fred"]
+
+
+def test_descendants_query_with_pending_nodes(session, base_tree):
+    bert = select_by_title(session, "Bert")
+    chuck = select_by_title(session, "Chuck")
+    session.add_all([Node(title="George", parent=bert), Node(title="Harry", parent=chuck)])
+    inclusive = chuck.descendants_query(inclusive=True)
+    assert [node.title for node in inclusive] == ["Chuck", "Donna", "Eddie", "Fred", "Harry"]
+
+
+def test_descendants_query_uses_index(session, base_tree):
+    chuck = select_by_title(session, "Chuck")
+    query = chuck.descendants_query().statement.compile(
+        session.bind, compile_kwargs={"literal_binds": True}
+    )
+    plan = session.execute(text(f"EXPLAIN QUERY PLAN {query}")).all()
+    assert any("USING INDEX ix_node_lft_rgt" in row[-1] for row in plan)
+
+
+def test_nested_set_indexes_with_own_table_args():
+    class Category(declarative_base(), NestedSet):
+        __tablename__ = "category"
+        __table_args__ = (UniqueConstraint("name"), *nested_set_indexes("category"))
+        id: Mapped[int] = mapped_column(Integer, primary_key=True)
+        name: Mapped[str]
+
+    assert {index.name for index in Category.__table__.indexes} == {
+        "ix_category_lft_rgt",
+        "ix_category_rgt",
+    }
+
+
+def test_is_ancestor_of(session, base_tree):
+    chuck = select_by_title(session, "Chuck")
+    eddie = select_by_title(session, "Eddie")
+    assert chuck.is_ancestor_of(eddie)
+    assert not eddie.is_ancestor_of(chuck)
+    assert not chuck.is_ancestor_of(chuck)
+    assert chuck.is_ancestor_of(chuck, inclusive=True)
+    assert eddie.is_descendant_of(chuck)
+    ancestors = session.query(Node).filter(Node.is_ancestor_of(eddie))
+    assert [node.title for node in ancestors.order_by(Node.left)] == ["Albert", "Chuck"]
+    descendants = session.query(Node).filter(Node.is_descendant_of(chuck))
+    assert [node.title for node in descendants.order_by(Node.left)] == [
+        "Donna",
+        "Eddie",
+        "Fred",
+    ]
 
 
 def test_move_before(session, base_tree):
@@ -62,3 +182,253 @@ def test_move_inside(session, base_tree):
     session.commit()
     assert eddie.right == donna.right + 1
     assert eddie.left == donna.left - 1
+
+
+@pytest.mark.parametrize(
+    "method, mover, target, positions",
+    [
+        ("move_before", "Fred", "Donna", {"Fred": (5, 6), "Donna": (7, 8)}),
+        ("move_after", "Donna", "Fred", {"Eddie": (5, 6), "Donna": (9, 10)}),
+        ("move_inside", "Bert", "Eddie", {"Bert": (6, 7), "Chuck": (2, 11)}),
+    ],
+)
+def test_move_single_update(
+    session, base_tree, statements, method, mover, target, positions
+):
+    node = select_by_title(session, mover)
+    target = select_by_title(session, target)
+    statements.clear()
+    getattr(node, method)(target)
+    assert len(statements) == 1
+    assert statements[0].startswith("UPDATE")
+    session.commit()
+    session.expire_all()
+    for title, position in positions.items():
+        node = select_by_title(session, title)
+        assert (node.left, node.right) == position
+
+
+def test_move_after_next_sibling(session, base_tree, statements):
+    donna = select_by_title(session, "Donna")
+    eddie = select_by_title(session, "Eddie")
+    untouched = {
+        node.title: (node.left, node.right)
+        for node in session.query(Node).filter(Node.title.notin_(["Donna", "Eddie"]))
+    }
+    statements.clear()
+    donna.move_after(eddie)
+    assert len(statements) == 1
+    assert statements[0].startswith("UPDATE")
+    session.commit()
+    assert (eddie.left, eddie.right, donna.left, donna.right) == (5, 6, 7, 8)
+    assert {
+        node.title: (node.left, node.right)
+        for node in session.query(Node).filter(Node.title.notin_(["Donna", "Eddie"]))
+    } == untouched
+
+
+def test_move_with_pending_child_of_target(session, base_tree):
+    bert = select_by_title(session, "Bert")
+    chuck = select_by_title(session, "Chuck")
+    session.add(Node(title="George", parent=bert))
+    chuck.move_before(bert)
+    session.commit()
+    session.expire_all()
+    assert_tree(
+        base_tree,
+        NodeTuple(
+            title="Albert",
+            children=(
+                NodeTuple(
+                    title="Chuck",
+                    children=(
+                        NodeTuple(title="Donna"),
+                        NodeTuple(title="Eddie"),
+                        NodeTuple(title="Fred"),
+                    ),
+                ),
+                NodeTuple(title="Bert", children=(NodeTuple(title="George"),)),
+            ),
+        ),
+    )
+
+
+def test_move_to_same_place(session, base_tree, statements):
+    chuck = select_by_title(session, "Chuck")
+    donna = select_by_title(session, "Donna")
+    eddie = select_by_title(session, "Eddie")
+    fred = select_by_title(session, "Fred")
+    statements.clear()
+    donna.move_before(eddie)
+    eddie.move_after(donna)
+    fred.move_inside(chuck)
+    assert statements == []
+
+
+def test_children_reset_after_move(session, base_tree):
+    eddie = select_by_title(session, "Eddie")
+    donna = select_by_title(session, "Donna")
+    base_tree.generate_tree()
+    donna.move_inside(eddie)
+    assert eddie.children is None
+    assert base_tree.children is None
+    assert model_to_tree(base_tree).children[1].children[0] == NodeTuple(
+        title="Eddie", children=(NodeTuple(title="Donna"),)
+    )
+
+
+def test_insert_keeps_loaded_nodes_in_sync(session, base_tree):
+    bert = select_by_title(session, "Bert")
+    chuck = select_by_title(session, "Chuck")
+    george = Node(title="George", parent=bert)
+    harry = Node(title="Harry", parent=george)
+    session.add_all([george, harry, Node(title="Ian", parent=bert)])
+    session.flush()
+    loaded = {node.title: (node.left, node.right) for node in (base_tree, bert, chuck)}
+    session.expire_all()
+    assert loaded == {
+        node.title: (node.left, node.right) for node in (base_tree, bert, chuck)
+    }
+    assert loaded == {"Albert": (1, 18), "Bert": (2, 9), "Chuck": (10, 17)}
+
+
+def test_roots_in_one_flush(session, base_tree, statements):
+    roots = [Node(title=title) for title in ("George", "Harry", "Ian")]
+    session.add_all(roots)
+    statements.clear()
+    session.flush()
+    assert statement_kinds(statements) == ["SELECT", "INSERT"]
+    assert [(root.left, root.right) for root in roots] == [(13, 14), (15, 16), (17, 18)]
+
+
+def test_bulk_mode(session, statements):
+    with Node.bulk_mode(session):
+        albert = Node(title="Albert")
+        chuck = Node(title="Chuck", parent=albert)
+        session.add_all(
+            [
+                albert,
+                Node(title="Bert", parent=albert),
+                chuck,
+                Node(title="Donna", parent=chuck),
+                Node(title="Eddie", parent=chuck),
+                Node(title="Fred", parent=chuck),
+            ]
+        )
+        statements.clear()
+    assert statement_kinds(statements) == ["SELECT", "INSERT"]
+    session.commit()
+    assert_tree(albert, OUTPUT_TREE)
+
+
+def test_bulk_mode_existing_parents(session, base_tree, statements):
+    bert = select_by_title(session, "Bert")
+    donna = select_by_title(session, "Donna")
+    with Node.bulk_mode(session):
+        george = Node(title="George", parent=bert)
+        session.add_all(
+            [
+                george,
+                Node(title="Harry", parent=george),
+                Node(title="Ian", parent=donna),
+                Node(title="Jack"),
+            ]
+        )
+        statements.clear()
+    assert statement_kinds(statements) == ["UPDATE", "SELECT", "INSERT"]
+    session.commit()
+    expected = NodeTuple(
+        title="Albert",
+        children=(
+            NodeTuple(
+                title="Bert",
+                children=(
+                    NodeTuple(title="George", children=(NodeTuple(title="Harry"),)),
+                ),
+            ),
+            NodeTuple(
+                title="Chuck",
+                children=(
+                    NodeTuple(title="Donna", children=(NodeTuple(title="Ian"),)),
+                    NodeTuple(title="Eddie"),
+                    NodeTuple(title="Fred"),
+                ),
+            ),
+        ),
+    )
+    assert_tree(base_tree, expected)
+    jack = select_by_title(session, "Jack")
+    assert (jack.left, jack.right) == (base_tree.right + 1, base_tree.right + 2)
+
+
+def test_delete_and_insert_after_commit(session):
+    albert = Node(title="Albert")
+    bert = Node(title="Bert", parent=albert)
+    chuck = Node(title="Chuck")
+    donna = Node(title="Donna", parent=chuck)
+    eddie = Node(title="Eddie", parent=chuck)
+    fred = Node(title="Fred")
+    george = Node(title="George", parent=fred)
+    session.add_all([albert, bert, chuck, donna, eddie, fred, george])
+    session.commit()
+    session.delete(donna)
+    session.add_all([Node(title="Harry", parent=bert), Node(title="Ian", parent=bert)])
+    session.flush()
+    loaded = {node.title: (node.left, node.right) for node in (chuck, eddie, fred, george)}
+    session.expire_all()
+    assert loaded == {
+        node.title: (node.left, node.right) for node in (chuck, eddie, fred, george)
+    }
+    assert loaded == {
+        "Chuck": (9, 12),
+        "Eddie": (10, 11),
+        "Fred": (13, 16),
+        "George": (14, 15),
+    }
+
+
+def test_insert_after_savepoint_rollback(session, base_tree):
+    bert = select_by_title(session, "Bert")
+    chuck = select_by_title(session, "Chuck")
+    savepoint = session.begin_nested()
+    session.add(Node(title="George", parent=bert))
+    session.flush()
+    savepoint.rollback()
+    session.add(Node(title="Harry", parent=chuck))
+    session.flush()
+    session.expire_all()
+    assert model_to_tree(base_tree) == NodeTuple(
+        title="Albert",
+        children=(
+            NodeTuple(title="Bert"),
+            NodeTuple(
+                title="Chuck",
+                children=(
+                    NodeTuple(title="Donna"),
+                    NodeTuple(title="Eddie"),
+                    NodeTuple(title="Fred"),
+                    NodeTuple(title="Harry"),
+                ),
+            ),
+        ),
+    )
+
+
+def test_delete_after_savepoint_rollback(session, base_tree):
+    chuck = select_by_title(session, "Chuck")
+    savepoint = session.begin_nested()
+    session.delete(select_by_title(session, "Bert"))
+    session.flush()
+    savepoint.rollback()
+    session.add(Node(title="George", parent=chuck))
+    session.flush()
+    session.expire_all()
+    assert [(node.title, node.left, node.right) for node in (base_tree, chuck)] == [
+        ("Albert", 1, 14),
+        ("Chuck", 4, 13),
+    ]
+
+
+def test_listeners_scoped_to_session(session, inserted_tree):
+    assert event.contains(session, "after_flush", after_flush)
+    assert not event.contains(type(session), "after_flush", after_flush)